@@ -1,12 +1,22 @@
 import os
-import datetime
 import re
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 
+import orjson
+from cachetools import TTLCache
 import redis
+from redis.backoff import ExponentialBackoff
+from redis.retry import Retry
 import jwt
 from flask import Flask, request, jsonify
-from functools import wraps
-from werkzeug.security import generate_password_hash, check_password_hash
+from flask.json.provider import JSONProvider
+from functools import lru_cache, wraps
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHash, VerificationError
+from werkzeug.security import check_password_hash
 from flask_cors import CORS
 
 # -----------------------------
@@ -19,78 +29,245 @@ REDIS_DB = int(os.environ.get("REDIS_DB", 0))
 REDIS_SOCKET_TIMEOUT = float(os.environ.get("REDIS_SOCKET_TIMEOUT", 2.0))
 REDIS_SOCKET_CONNECT_TIMEOUT = float(os.environ.get("REDIS_SOCKET_CONNECT_TIMEOUT", 2.0))
 REDIS_TLS = os.environ.get("REDIS_TLS", "false").lower() == "true"
+REDIS_MAX_CONNECTIONS = int(os.environ.get("REDIS_MAX_CONNECTIONS", 16))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.environ.get("REDIS_HEALTH_CHECK_INTERVAL", 30))
 
 JWT_SECRET = os.environ.get("JWT_SECRET", "dev-secret-change-me")
 JWT_ALGO = os.environ.get("JWT_ALGO", "HS256")
 TOKEN_EXP_HOURS = 24
+JWT_KEY = JWT_SECRET.encode()
+JWT_ALGORITHMS = [JWT_ALGO]
+
+# Argon2id parameters, defaulting to the OWASP profile (46 MiB, 1 iteration,
+# 1 lane) sized to fit comfortably inside the Lambda memory limit. Existing
+# hashes are upgraded on the next successful login when these change.
+ARGON2_TIME_COST = int(os.environ.get("ARGON2_TIME_COST", 1))
+ARGON2_MEMORY_COST = int(os.environ.get("ARGON2_MEMORY_COST", 47104))  # KiB
+ARGON2_PARALLELISM = int(os.environ.get("ARGON2_PARALLELISM", 1))
+PASSWORD_HASH_WORKERS = int(os.environ.get("PASSWORD_HASH_WORKERS", 2))
+
+# Include Redis diagnostics in every delete-account response (otherwise only
+# with ?debug=1)
+DELETE_DIAGNOSTICS = os.environ.get("DELETE_DIAGNOSTICS", "false").lower() == "true"
+
+# Largest request body accepted; larger ones get a 413 before any parsing
+MAX_BODY_BYTES = int(os.environ.get("MAX_BODY_BYTES", 16 * 1024))
+
+# Seconds a warm container may serve a user's profile from memory
+USER_CACHE_TTL = int(os.environ.get("USER_CACHE_TTL", 10))
+
+
+class ORJSONProvider(JSONProvider):
+    """
+    JSON provider backed by orjson so jsonify() and request.get_json()
+    encode/decode in C instead of the stdlib json module.
+    """
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(obj).decode()
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
+    def response(self, *args, **kwargs):
+        # Hand orjson's bytes straight to the response instead of going
+        # through dumps() and re-encoding the str.
+        obj = self._prepare_response_obj(args, kwargs)
+        return self._app.response_class(orjson.dumps(obj), mimetype="application/json")
+
 
 app = Flask(__name__)
+app.json = ORJSONProvider(app)
+app.config["MAX_CONTENT_LENGTH"] = MAX_BODY_BYTES
 CORS(app)  # allow cross-origin (for React frontend)
 
-_redis_client = None
+# Pre-encoded bodies for constant responses. A fresh Response is still built
+# per request because after_request hooks (CORS) mutate headers.
+ROOT_RESPONSE_BODY = orjson.dumps({
+    "status": "running",
+    "service": "User Account API",
+    "auth": "enabled"
+})
+HEALTH_RESPONSE_BODY = orjson.dumps({"status": "ok"})
+REDIS_UNAVAILABLE_BODY = orjson.dumps({"error": "Redis unavailable"})
+EXPECTED_JSON_ERROR_BODY = orjson.dumps({"error": "Expected JSON body"})
+REQUEST_TOO_LARGE_BODY = orjson.dumps({"error": "Request body too large"})
+
+
+def static_json_response(body: bytes, status: int = 200):
+    return app.response_class(body, status=status, mimetype="application/json")
+
+
+password_hasher = PasswordHasher(
+    time_cost=ARGON2_TIME_COST,
+    memory_cost=ARGON2_MEMORY_COST,
+    parallelism=ARGON2_PARALLELISM,
+)
+
+# Password hashing runs on a small dedicated pool purely as a concurrency
+# cap: the calling request still blocks on the result, but at most
+# PASSWORD_HASH_WORKERS 46 MiB Argon2 buffers are live at once. Threads
+# rather than processes because Lambda has no /dev/shm.
+_hash_pool = ThreadPoolExecutor(
+    max_workers=PASSWORD_HASH_WORKERS,
+    thread_name_prefix="password-hash",
+)
 
 
-def get_redis():
+def create_redis_pool():
     """
-    Lazy Redis client with TLS support for AWS ElastiCache.
+    Connection pool with TLS support for AWS ElastiCache.
+    Built once at import so warm Lambda invocations reuse the same
+    keep-alive connection instead of reconnecting per request.
     """
-    global _redis_client
-    if _redis_client is not None:
-        return _redis_client
+    keepalive_options = {}
+    for name, value in (("TCP_KEEPIDLE", 60), ("TCP_KEEPINTVL", 10), ("TCP_KEEPCNT", 3)):
+        if hasattr(socket, name):
+            keepalive_options[getattr(socket, name)] = value
+
+    pool_kwargs = {
+        "host": REDIS_HOST,
+        "port": REDIS_PORT,
+        "db": REDIS_DB,
+        "decode_responses": True,
+        "max_connections": REDIS_MAX_CONNECTIONS,
+        "timeout": REDIS_SOCKET_CONNECT_TIMEOUT,
+        "socket_timeout": REDIS_SOCKET_TIMEOUT,
+        "socket_connect_timeout": REDIS_SOCKET_CONNECT_TIMEOUT,
+        "socket_keepalive": True,
+        "socket_keepalive_options": keepalive_options,
+        # PING connections idle longer than this before reuse and retry
+        # commands that hit a dropped socket, so a connection lost while the
+        # Lambda container was frozen doesn't fail the next request.
+        "health_check_interval": REDIS_HEALTH_CHECK_INTERVAL,
+        "retry_on_timeout": True,
+        "retry": Retry(ExponentialBackoff(), 2),
+    }
+    if REDIS_TLS:
+        pool_kwargs["connection_class"] = redis.SSLConnection
+        pool_kwargs["ssl_cert_reqs"] = None  # NOTE: for demo; in production validate certificates
+    return redis.BlockingConnectionPool(**pool_kwargs)
+
+
+_redis_pool = create_redis_pool()
+_redis_client = redis.StrictRedis(connection_pool=_redis_pool)
+
+# HSET the record only if the key does not exist yet: one atomic round-trip
+# instead of EXISTS + HSET, and no window for two signups to race.
+CREATE_USER_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+redis.call('HSET', KEYS[1], unpack(ARGV))
+return 1
+"""
+_create_user_script = _redis_client.register_script(CREATE_USER_LUA)
+
+# Counterpart for updates: HSET only if the user still exists, so a deleted
+# account is never recreated as a partial hash.
+UPDATE_USER_LUA = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+if #ARGV > 0 then
+    redis.call('HSET', KEYS[1], unpack(ARGV))
+end
+return 1
+"""
+_update_user_script = _redis_client.register_script(UPDATE_USER_LUA)
+
+# Login-time rehash: replace the password hash only if it is still the one
+# that was verified, so a concurrent password change or account delete is
+# never overwritten (HGET on a missing key returns false, so nothing is set).
+REHASH_PASSWORD_LUA = """
+if redis.call('HGET', KEYS[1], 'password') ~= ARGV[1] then
+    return 0
+end
+redis.call('HSET', KEYS[1], 'password', ARGV[2])
+return 1
+"""
+_rehash_password_script = _redis_client.register_script(REHASH_PASSWORD_LUA)
+
+
+def requires_redis(f):
+    """
+    Inject the shared Redis client as the ``r`` keyword argument.
+    Connections are opened lazily by the pool, so connection failures
+    surface from the command and are turned into a 503 by
+    redis_unavailable below.
+    """
+    @wraps(f)
+    def wrapper(*args, **kwargs):
+        return f(*args, r=_redis_client, **kwargs)
+    return wrapper
+
+
+# Routes that catch broad exceptions re-raise these so the outage still
+# reaches redis_unavailable and becomes a 503 instead of a 500
+REDIS_UNAVAILABLE_ERRORS = (redis.exceptions.ConnectionError, redis.exceptions.TimeoutError)
 
-    try:
-        client = redis.StrictRedis(
-            host=REDIS_HOST,
-            port=REDIS_PORT,
-            db=REDIS_DB,
-            decode_responses=True,
-            socket_timeout=REDIS_SOCKET_TIMEOUT,
-            socket_connect_timeout=REDIS_SOCKET_CONNECT_TIMEOUT,
-            ssl=REDIS_TLS,
-            ssl_cert_reqs=None,  # NOTE: for demo; in production validate certificates
-        )
-        client.ping()
-        _redis_client = client
-        app.logger.info(f"Connected to Redis at {REDIS_HOST}:{REDIS_PORT}, tls={REDIS_TLS}")
-        return _redis_client
-    except Exception as e:
-        app.logger.error(f"Redis connect failed: {e}")
-        _redis_client = None
-        return None
+
+@app.errorhandler(redis.exceptions.ConnectionError)
+@app.errorhandler(redis.exceptions.TimeoutError)
+def redis_unavailable(e):
+    app.logger.error("Redis unavailable: %s", e)
+    return static_json_response(REDIS_UNAVAILABLE_BODY, 503)
+
+
+@app.errorhandler(413)
+def request_too_large(e):
+    return static_json_response(REQUEST_TOO_LARGE_BODY, 413)
 
 
 # -----------------------------
 # Helper functions
 # -----------------------------
 
+@lru_cache(maxsize=4096)
 def generate_user_key(email: str) -> str:
     return f"user:{email}"
 
 
+@lru_cache(maxsize=4096)
 def notifications_key(email: str) -> str:
     return f"settings:notifications:{email}"
 
 
+@lru_cache(maxsize=4096)
 def billing_key(email: str) -> str:
     return f"settings:billing:{email}"
 
 
+@lru_cache(maxsize=4096)
 def plans_key(email: str) -> str:
     return f"settings:plans:{email}"
 
 
+# One PyJWT instance reused for every encode/decode instead of the
+# module-level convenience wrappers
+_jwt = jwt.PyJWT()
+
+
 def create_token(email: str) -> str:
-    now = datetime.datetime.utcnow()
+    now = int(time.time())
     payload = {
         "sub": email,
         "iat": now,
-        "exp": now + datetime.timedelta(hours=TOKEN_EXP_HOURS),
+        "exp": now + TOKEN_EXP_HOURS * 3600,
     }
-    return jwt.encode(payload, JWT_SECRET, algorithm=JWT_ALGO)
+    return _jwt.encode(payload, JWT_KEY, algorithm=JWT_ALGO)
+
+
+# Verified token payloads keyed by the raw bearer string, so a client reusing
+# its token skips HMAC verification. Entries are also checked against their
+# own "exp" claim on every hit.
+TOKEN_CACHE_SIZE = 4096
+_token_cache = TTLCache(maxsize=TOKEN_CACHE_SIZE, ttl=TOKEN_EXP_HOURS * 3600)
+_token_cache_lock = threading.Lock()
 
 
 def decode_token(token: str):
-    return jwt.decode(token, JWT_SECRET, algorithms=[JWT_ALGO])
+    return _jwt.decode(token, JWT_KEY, algorithms=JWT_ALGORITHMS)
 
 
 def require_auth(f):
@@ -101,20 +278,128 @@ def require_auth(f):
             return jsonify({"error": "Authorization token missing"}), 401
 
         token = auth_header.split(" ", 1)[1].strip()
+        with _token_cache_lock:
+            payload = _token_cache.get(token)
+
+        if payload is not None and payload["exp"] > time.time():
+            request.user_email = payload["sub"]
+            return f(*args, **kwargs)
+
         try:
             payload = decode_token(token)
             request.user_email = payload.get("sub")
             if not request.user_email:
                 raise Exception("Invalid token payload")
         except Exception as e:
-            app.logger.warning(f"Auth failed: {e}")
+            app.logger.warning("Auth failed: %s", e)
             return jsonify({"error": "Invalid or expired token"}), 401
 
+        # Only successfully verified tokens are cached
+        if "exp" in payload:
+            with _token_cache_lock:
+                _token_cache[token] = payload
+
         return f(*args, **kwargs)
     return wrapper
 
 
+def _verify_password(stored_hash: str, pw: str) -> bool:
+    if not stored_hash.startswith("$argon2"):
+        return check_password_hash(stored_hash, pw)
+    try:
+        return password_hasher.verify(stored_hash, pw)
+    except (VerificationError, InvalidHash):
+        return False
+
+
+def hash_password(pw: str) -> str:
+    return _hash_pool.submit(password_hasher.hash, pw).result()
+
+
+def verify_password(stored_hash: str, pw: str) -> bool:
+    """
+    Verify against an Argon2id hash, falling back to werkzeug for
+    accounts created before the switch to Argon2.
+    """
+    if not stored_hash:
+        return False
+    return _hash_pool.submit(_verify_password, stored_hash, pw).result()
+
+
+def password_needs_rehash(stored_hash: str) -> bool:
+    """
+    True for legacy werkzeug hashes and Argon2 hashes made with
+    parameters other than the current ARGON2_* settings.
+    """
+    if not stored_hash.startswith("$argon2"):
+        return True
+    return password_hasher.check_needs_rehash(stored_hash)
+
+
 EMAIL_REGEX = re.compile(r"^[^@\s]+@[^@\s]+\.[^@\s]+$")
+NON_DIGIT_REGEX = re.compile(r"[^0-9]+")
+SIGNUP_REQUIRED_FIELDS = ("email", "first_name", "last_name", "password", "confirm_password")
+# Profile fields PUT /users/<email> may overwrite; password is handled separately
+USER_UPDATE_FIELDS = ("first_name", "last_name")
+# Fields returned to clients; the password hash is never read for these
+PROFILE_FIELDS = ("email", "first_name", "last_name")
+# Length command per Redis type, used by the delete_account diagnostics
+KEY_LENGTH_COMMANDS = {
+    "hash": "hlen",
+    "string": "strlen",
+    "list": "llen",
+    "set": "scard",
+    "zset": "zcard",
+}
+
+
+# Per-process profile cache for the read-heavy /auth/me and /users/<email>
+# routes. Every handler that changes or deletes a user invalidates its entry
+# and bumps the user's generation; a read only fills the cache if the
+# generation is unchanged since before its HMGET, so a lookup racing an
+# update in the same container can't put the old profile back. Other Lambda
+# containers can still serve a stale profile for up to USER_CACHE_TTL.
+_profile_cache = TTLCache(maxsize=1024, ttl=USER_CACHE_TTL)
+# Generations only need to outlive an in-flight HMGET
+_profile_generations = TTLCache(maxsize=4096, ttl=60)
+_profile_cache_lock = threading.Lock()
+
+
+def get_profile(r, email: str):
+    """
+    Returns the user's PROFILE_FIELDS as a dict, or None if the user
+    does not exist.
+    """
+    with _profile_cache_lock:
+        profile = _profile_cache.get(email)
+        generation = _profile_generations.get(email, 0)
+    if profile is not None:
+        return profile
+
+    values = r.hmget(generate_user_key(email), PROFILE_FIELDS)
+    if values[0] is None:
+        return None
+
+    profile = dict(zip(PROFILE_FIELDS, values))
+    with _profile_cache_lock:
+        if _profile_generations.get(email, 0) == generation:
+            _profile_cache[email] = profile
+    return profile
+
+
+def invalidate_profile(email: str):
+    with _profile_cache_lock:
+        _profile_cache.pop(email, None)
+        _profile_generations[email] = _profile_generations.get(email, 0) + 1
+
+
+def json_body():
+    """
+    Parse the request body once. Returns the JSON object, or None when the
+    body is missing, malformed or not an object.
+    """
+    data = request.get_json(silent=True)
+    return data if isinstance(data, dict) else None
 
 
 def is_valid_email(email: str) -> bool:
@@ -127,9 +412,20 @@ def is_strong_password(pw: str):
     """
     if len(pw) < 8:
         return False, "Password must be at least 8 characters"
-    if not re.search(r"[A-Z]", pw):
+
+    # Single pass over the string instead of one regex search per rule
+    has_upper = has_digit = False
+    for ch in pw:
+        if "A" <= ch <= "Z":
+            has_upper = True
+        elif "0" <= ch <= "9":
+            has_digit = True
+        if has_upper and has_digit:
+            break
+
+    if not has_upper:
         return False, "Password must contain at least one uppercase letter"
-    if not re.search(r"[0-9]", pw):
+    if not has_digit:
         return False, "Password must contain at least one digit"
     return True, ""
 
@@ -143,16 +439,12 @@ def root():
     """
     Base health check for API Gateway root URL.
     """
-    return jsonify({
-        "status": "running",
-        "service": "User Account API",
-        "auth": "enabled"
-    }), 200
+    return static_json_response(ROOT_RESPONSE_BODY)
 
 
 @app.route("/health", methods=["GET"])
 def health():
-    return jsonify({"status": "ok"}), 200
+    return static_json_response(HEALTH_RESPONSE_BODY)
 
 
 # -----------------------------
@@ -160,13 +452,13 @@ def health():
 # -----------------------------
 
 @app.route("/auth/signup", methods=["POST"])
-def signup():
-    if not request.is_json:
-        return jsonify({"error": "Expected JSON body"}), 400
+@requires_redis
+def signup(r):
+    data = json_body()
+    if data is None:
+        return static_json_response(EXPECTED_JSON_ERROR_BODY, 400)
 
-    data = request.get_json()
-    required = ["email", "first_name", "last_name", "password", "confirm_password"]
-    if not all(field in data and data[field] for field in required):
+    if not all(data.get(field) for field in SIGNUP_REQUIRED_FIELDS):
         return jsonify({"error": "Missing required fields"}), 400
 
     email = data["email"].strip().lower()
@@ -182,15 +474,8 @@ def signup():
     if not ok:
         return jsonify({"error": msg}), 400
 
-    r = get_redis()
-    if r is None:
-        return jsonify({"error": "Redis unavailable"}), 503
-
     user_key = generate_user_key(email)
-    if r.exists(user_key):
-        return jsonify({"error": f"User with email '{email}' already exists"}), 409
-
-    hashed = generate_password_hash(pw)
+    hashed = hash_password(pw)
     record = {
         "email": email,
         "first_name": data["first_name"],
@@ -199,7 +484,14 @@ def signup():
     }
 
     try:
-        r.hset(user_key, mapping=record)
+        created = _create_user_script(
+            keys=[user_key],
+            args=[item for pair in record.items() for item in pair],
+            client=r,
+        )
+        if not created:
+            return jsonify({"error": f"User with email '{email}' already exists"}), 409
+
         token = create_token(email)
         return jsonify({
             "message": "Signup successful",
@@ -210,17 +502,20 @@ def signup():
                 "last_name": data["last_name"],
             },
         }), 201
+    except REDIS_UNAVAILABLE_ERRORS:
+        raise
     except Exception as e:
         app.logger.exception("Signup failed")
         return jsonify({"error": f"Failed to sign up: {str(e)}"}), 500
 
 
 @app.route("/auth/login", methods=["POST"])
-def login():
-    if not request.is_json:
-        return jsonify({"error": "Expected JSON body"}), 400
+@requires_redis
+def login(r):
+    data = json_body()
+    if data is None:
+        return static_json_response(EXPECTED_JSON_ERROR_BODY, 400)
 
-    data = request.get_json()
     email = data.get("email", "").strip().lower()
     password = data.get("password", "")
 
@@ -230,57 +525,58 @@ def login():
     if not is_valid_email(email):
         return jsonify({"error": "Invalid email format"}), 400
 
-    r = get_redis()
-    if r is None:
-        return jsonify({"error": "Redis unavailable"}), 503
-
     user_key = generate_user_key(email)
-    user = r.hgetall(user_key)
-    if not user:
+    stored_hash, first_name, last_name = r.hmget(user_key, "password", "first_name", "last_name")
+    if stored_hash is None:
         return jsonify({"error": "Invalid email or password"}), 401
 
-    stored_hash = user.get("password", "")
-    if not check_password_hash(stored_hash, password):
+    if not verify_password(stored_hash, password):
         return jsonify({"error": "Invalid email or password"}), 401
 
+    if password_needs_rehash(stored_hash):
+        try:
+            _rehash_password_script(
+                keys=[user_key],
+                args=[stored_hash, hash_password(password)],
+                client=r,
+            )
+        except Exception:
+            app.logger.exception("Password rehash failed")
+
     token = create_token(email)
     return jsonify({
         "message": "Login successful",
         "token": token,
         "user": {
             "email": email,
-            "first_name": user.get("first_name", ""),
-            "last_name": user.get("last_name", ""),
+            "first_name": first_name or "",
+            "last_name": last_name or "",
         },
     }), 200
 
 
 @app.route("/auth/me", methods=["GET"])
 @require_auth
-def me():
-    r = get_redis()
-    if r is None:
-        return jsonify({"error": "Redis unavailable"}), 503
-
-    user_key = generate_user_key(request.user_email)
-    user = r.hgetall(user_key)
-    if not user:
+@requires_redis
+def me(r):
+    profile = get_profile(r, request.user_email)
+    if profile is None:
         return jsonify({"error": "User not found"}), 404
 
-    user.pop("password", None)
-    return jsonify(user), 200
+    return jsonify(profile), 200
 
 @app.route("/auth/profile", methods=["PUT"])
 @require_auth
-def update_profile():
+@requires_redis
+def update_profile(r):
     """
     Securely update first_name / last_name.
     Requires current_password to confirm identity.
     """
-    if not request.is_json:
-        return jsonify({"error": "Expected JSON body"}), 400
+    data = json_body()
+    if data is None:
+        return static_json_response(EXPECTED_JSON_ERROR_BODY, 400)
 
-    data = request.get_json()
     first_name = data.get("first_name")
     last_name = data.get("last_name")
     current_password = data.get("current_password")
@@ -288,10 +584,6 @@ def update_profile():
     if not first_name or not last_name or not current_password:
         return jsonify({"error": "first_name, last_name and current_password are required"}), 400
 
-    r = get_redis()
-    if r is None:
-        return jsonify({"error": "Redis unavailable"}), 503
-
     email = request.user_email
     user_key = generate_user_key(email)
     user = r.hgetall(user_key)
@@ -299,12 +591,15 @@ def update_profile():
         return jsonify({"error": "User not found"}), 404
 
     stored_hash = user.get("password", "")
-    if not check_password_hash(stored_hash, current_password):
+    if not verify_password(stored_hash, current_password):
         return jsonify({"error": "Current password is incorrect"}), 401
 
     try:
         r.hset(user_key, mapping={"first_name": first_name, "last_name": last_name})
+        invalidate_profile(email)
         return jsonify({"message": "Profile updated successfully"}), 200
+    except REDIS_UNAVAILABLE_ERRORS:
+        raise
     except Exception as e:
         app.logger.exception("Profile update failed")
         return jsonify({"error": f"Failed to update profile: {str(e)}"}), 500
@@ -312,14 +607,15 @@ def update_profile():
 
 @app.route("/auth/change-password", methods=["POST"])
 @require_auth
-def change_password():
+@requires_redis
+def change_password(r):
     """
     Secure password change: requires old_password, new_password, confirm_password.
     """
-    if not request.is_json:
-        return jsonify({"error": "Expected JSON body"}), 400
+    data = json_body()
+    if data is None:
+        return static_json_response(EXPECTED_JSON_ERROR_BODY, 400)
 
-    data = request.get_json()
     old_password = data.get("old_password")
     new_password = data.get("new_password")
     confirm_password = data.get("confirm_password")
@@ -334,10 +630,6 @@ def change_password():
     if not ok:
         return jsonify({"error": msg}), 400
 
-    r = get_redis()
-    if r is None:
-        return jsonify({"error": "Redis unavailable"}), 503
-
     email = request.user_email
     user_key = generate_user_key(email)
     user = r.hgetall(user_key)
@@ -345,13 +637,15 @@ def change_password():
         return jsonify({"error": "User not found"}), 404
 
     stored_hash = user.get("password", "")
-    if not check_password_hash(stored_hash, old_password):
+    if not verify_password(stored_hash, old_password):
         return jsonify({"error": "Old password is incorrect"}), 401
 
     try:
-        new_hash = generate_password_hash(new_password)
+        new_hash = hash_password(new_password)
         r.hset(user_key, "password", new_hash)
         return jsonify({"message": "Password changed successfully"}), 200
+    except REDIS_UNAVAILABLE_ERRORS:
+        raise
     except Exception as e:
         app.logger.exception("Password change failed")
         return jsonify({"error": f"Failed to change password: {str(e)}"}), 500
@@ -361,29 +655,29 @@ def change_password():
 # -----------------------------
 @app.route("/auth/delete-account", methods=["DELETE", "POST"])
 @require_auth
-def delete_account():
+@requires_redis
+def delete_account(r):
     """
     Delete account with per-key deletion to avoid Redis Cluster CROSSSLOT errors.
-    Returns diagnostics for debugging.
+    Returns diagnostics for debugging when called with ?debug=1 or when
+    DELETE_DIAGNOSTICS is enabled.
     """
-    if not request.is_json:
-        return jsonify({"error": "Expected JSON body"}), 400
+    data = json_body()
+    if data is None:
+        return static_json_response(EXPECTED_JSON_ERROR_BODY, 400)
 
-    data = request.get_json()
     password = data.get("password")
     if not password:
         return jsonify({"error": "Password is required"}), 400
 
-    r = get_redis()
-    if r is None:
-        return jsonify({"error": "Redis unavailable"}), 503
-
     email = request.user_email
     user_key = generate_user_key(email)
 
     # ensure the user exists and password matches
     try:
         user = r.hgetall(user_key)
+    except REDIS_UNAVAILABLE_ERRORS:
+        raise
     except Exception as e:
         app.logger.exception("Redis hgetall failed when reading user")
         return jsonify({"error": "Failed to read user from Redis", "detail": str(e)}), 500
@@ -392,7 +686,7 @@ def delete_account():
         return jsonify({"error": "User not found"}), 404
 
     stored_hash = user.get("password", "")
-    if not check_password_hash(stored_hash, password):
+    if not verify_password(stored_hash, password):
         return jsonify({"error": "Password is incorrect"}), 401
 
     # Build keys using your helper functions
@@ -404,79 +698,114 @@ def delete_account():
     ]
     keys_to_delete = [k for k in keys_to_delete if k]
 
-    # Gather pre-delete diagnostics
+    if not (DELETE_DIAGNOSTICS or request.args.get("debug") == "1"):
+        # Common path: all UNLINKs in one pipelined round-trip
+        pipe = r.pipeline(transaction=False)
+        for k in keys_to_delete:
+            pipe.unlink(k)
+        try:
+            pipe.execute()
+        except REDIS_UNAVAILABLE_ERRORS:
+            raise
+        except Exception as e:
+            app.logger.exception("Failed to delete account keys")
+            return jsonify({"error": "Failed to delete account", "detail": str(e)}), 500
+        invalidate_profile(email)
+        return jsonify({"message": "Account deleted successfully"}), 200
+
+    # Gather pre-delete diagnostics. Each phase is one non-transactional
+    # pipeline: commands stay per-key (no CROSSSLOT) but share a round-trip.
     diagnostics = {"redis_host": REDIS_HOST, "redis_port": REDIS_PORT, "tls": REDIS_TLS}
     try:
-        try:
-            diagnostics["ping"] = r.ping()
-        except Exception as ping_err:
-            diagnostics["ping_error"] = str(ping_err)
+        pipe = r.pipeline(transaction=False)
+        pipe.ping()
+        for k in keys_to_delete:
+            pipe.exists(k)
+            pipe.type(k)
+        results = pipe.execute(raise_on_error=False)
+
+        if isinstance(results[0], Exception):
+            diagnostics["ping_error"] = str(results[0])
+        else:
+            diagnostics["ping"] = results[0]
 
         diag_keys = {}
-        for k in keys_to_delete:
-            try:
-                exists = bool(r.exists(k))
-                ktype = r.type(k) if exists else None
-                length = None
-                if exists:
-                    if ktype == "hash":
-                        length = r.hlen(k)
-                    elif ktype == "string":
-                        length = r.strlen(k)
-                    elif ktype == "list":
-                        length = r.llen(k)
-                    elif ktype == "set":
-                        length = r.scard(k)
-                    elif ktype == "zset":
-                        length = r.zcard(k)
-                diag_keys[k] = {"exists": exists, "type": ktype, "length": length}
-            except Exception as e:
-                app.logger.exception("Failed to inspect key %s", k)
-                diag_keys[k] = {"inspect_error": str(e)}
+        length_keys = []
+        pipe = r.pipeline(transaction=False)
+        for i, k in enumerate(keys_to_delete):
+            exists_res, type_res = results[1 + 2 * i], results[2 + 2 * i]
+            if isinstance(exists_res, Exception) or isinstance(type_res, Exception):
+                err = exists_res if isinstance(exists_res, Exception) else type_res
+                app.logger.error("Failed to inspect key %s: %s", k, err)
+                diag_keys[k] = {"inspect_error": str(err)}
+                continue
+            exists = bool(exists_res)
+            ktype = type_res if exists else None
+            diag_keys[k] = {"exists": exists, "type": ktype, "length": None}
+            length_command = KEY_LENGTH_COMMANDS.get(ktype)
+            if length_command:
+                getattr(pipe, length_command)(k)
+                length_keys.append(k)
+
+        if length_keys:
+            for k, length in zip(length_keys, pipe.execute(raise_on_error=False)):
+                if isinstance(length, Exception):
+                    app.logger.error("Failed to inspect key %s: %s", k, length)
+                    diag_keys[k] = {"inspect_error": str(length)}
+                else:
+                    diag_keys[k]["length"] = length
 
         diagnostics["keys"] = diag_keys
+    except REDIS_UNAVAILABLE_ERRORS:
+        raise
     except Exception as e:
         app.logger.exception("Diagnostics gathering failed")
         return jsonify({"error": "Failed gathering diagnostics", "detail": str(e)}), 500
 
-    # Per-key delete to avoid CROSSSLOT
+    # Per-key delete to avoid CROSSSLOT, with the post-delete EXISTS checks
+    # queued behind the UNLINKs in the same pipeline
     try:
-        app.logger.info(f"Attempting to delete keys for {email} (per-key): {keys_to_delete}")
+        app.logger.info("Attempting to delete keys for %s (per-key): %s", email, keys_to_delete)
         deleted_total = 0
         per_key_results = {}
 
+        pipe = r.pipeline(transaction=False)
         for k in keys_to_delete:
-            try:
-                if hasattr(r, "unlink"):
-                    res = r.unlink(k)
-                    method = "unlink"
-                else:
-                    res = r.delete(k)
-                    method = "delete"
-                per_key_results[k] = {"method": method, "returned": res}
+            pipe.unlink(k)
+        for k in keys_to_delete:
+            pipe.exists(k)
+        results = pipe.execute(raise_on_error=False)
+        delete_results = results[:len(keys_to_delete)]
+        post_results = results[len(keys_to_delete):]
+
+        for k, res in zip(keys_to_delete, delete_results):
+            if isinstance(res, Exception):
+                app.logger.error("Failed deleting key %s: %s", k, res)
+                per_key_results[k] = {"error": str(res)}
+            else:
+                per_key_results[k] = {"method": "unlink", "returned": res}
                 deleted_total += int(res or 0)
-            except Exception as e:
-                app.logger.exception("Failed deleting key %s", k)
-                per_key_results[k] = {"error": str(e)}
 
-        app.logger.info(f"Per-key delete results: {per_key_results}")
+        app.logger.info("Per-key delete results: %s", per_key_results)
         diagnostics["delete_method"] = "per-key"
         diagnostics["delete_return"] = {"deleted_total": deleted_total, "per_key": per_key_results}
 
         # Re-check keys post-delete
         post_diag = {}
-        for k in keys_to_delete:
-            try:
-                exists = bool(r.exists(k))
-                post_diag[k] = {"exists": exists}
-            except Exception as e:
-                post_diag[k] = {"post_inspect_error": str(e)}
+        for k, res in zip(keys_to_delete, post_results):
+            if isinstance(res, Exception):
+                post_diag[k] = {"post_inspect_error": str(res)}
+            else:
+                post_diag[k] = {"exists": bool(res)}
         diagnostics["post_delete"] = post_diag
+        invalidate_profile(email)
 
         return jsonify({
             "message": "Attempted account deletion (per-key)",
             "diagnostics": diagnostics
         }), 200
+    except REDIS_UNAVAILABLE_ERRORS:
+        raise
     except Exception as e:
         app.logger.exception("Failed to delete account keys")
         diagnostics["delete_exception"] = str(e)
@@ -486,63 +815,100 @@ def delete_account():
 # Settings routes (Notifications, Billing, Plans)
 # -----------------------------
 
-@app.route("/settings/notifications", methods=["GET", "PUT"])
+# Settings flags are stored as strings: "true"/"false" for notifications,
+# "1"/"0" for plan add-ons
+BOOL_TO_STR = {True: "true", False: "false"}
+BOOL_TO_FLAG = {True: "1", False: "0"}
+NOTIFICATION_FIELDS = (
+    ("email_notifications", True),
+    ("sms_notifications", False),
+    ("push_notifications", False),
+)
+
+
+def notifications_payload(data):
+    return {
+        field: data.get(field, BOOL_TO_STR[default]) == "true"
+        for field, default in NOTIFICATION_FIELDS
+    }
+
+
+def billing_payload(data):
+    return {
+        "cardholder_name": data.get("cardholder_name", ""),
+        "card_last4": data.get("card_last4", ""),
+        "invoice_email": data.get("invoice_email", "")
+    }
+
+
+def plans_payload(data):
+    return {
+        "plan": data.get("plan", "basic"),
+        "extra_storage": data.get("extra_storage", "0") == "1",
+        "priority_support": data.get("priority_support", "0") == "1"
+    }
+
+
+@app.route("/settings", methods=["GET"])
 @require_auth
-def settings_notifications():
-    r = get_redis()
-    if r is None:
-        return jsonify({"error": "Redis unavailable"}), 503
+@requires_redis
+def all_settings(r):
+    """
+    Notifications, billing and plans in one response, read with a single
+    pipelined round-trip so the settings page needs one request.
+    """
+    email = request.user_email
+    pipe = r.pipeline(transaction=False)
+    pipe.hgetall(notifications_key(email))
+    pipe.hgetall(billing_key(email))
+    pipe.hgetall(plans_key(email))
+    notifications, billing, plans = pipe.execute()
+
+    return jsonify({
+        "notifications": notifications_payload(notifications),
+        "billing": billing_payload(billing),
+        "plans": plans_payload(plans),
+    }), 200
 
+
+@app.route("/settings/notifications", methods=["GET", "PUT"])
+@require_auth
+@requires_redis
+def settings_notifications(r):
     key = notifications_key(request.user_email)
 
     if request.method == "GET":
         data = r.hgetall(key) or {}
-        return jsonify({
-            "email_notifications": data.get("email_notifications", "true") == "true",
-            "sms_notifications": data.get("sms_notifications", "false") == "true",
-            "push_notifications": data.get("push_notifications", "false") == "true",
-        }), 200
+        return jsonify(notifications_payload(data)), 200
 
     # PUT
-    if not request.is_json:
-        return jsonify({"error": "Expected JSON body"}), 400
-    data = request.get_json()
-
-    email_notifications = bool(data.get("email_notifications", True))
-    sms_notifications = bool(data.get("sms_notifications", False))
-    push_notifications = bool(data.get("push_notifications", False))
+    data = json_body()
+    if data is None:
+        return static_json_response(EXPECTED_JSON_ERROR_BODY, 400)
 
     r.hset(key, mapping={
-        "email_notifications": "true" if email_notifications else "false",
-        "sms_notifications": "true" if sms_notifications else "false",
-        "push_notifications": "true" if push_notifications else "false",
+        field: BOOL_TO_STR[bool(data.get(field, default))]
+        for field, default in NOTIFICATION_FIELDS
     })
     return jsonify({"message": "Notification settings saved"}), 200
 
 
 @app.route("/settings/billing", methods=["GET", "PUT"])
 @require_auth
-def billing_settings():
-    r = get_redis()
-    if r is None:
-        return jsonify({"error": "Redis unavailable"}), 503
-
+@requires_redis
+def billing_settings(r):
     email = request.user_email
     billing_key_name = billing_key(email)  # use helper (settings:billing:email)
 
     if request.method == "GET":
         data = r.hgetall(billing_key_name) or {}
-        return jsonify({
-            "cardholder_name": data.get("cardholder_name", ""),
-            "card_last4": data.get("card_last4", ""),
-            "invoice_email": data.get("invoice_email", "")
-        })
+        return jsonify(billing_payload(data))
 
     # PUT
-    if not request.is_json:
-        return jsonify({"error": "Expected JSON body"}), 400
+    payload = json_body()
+    if payload is None:
+        return static_json_response(EXPECTED_JSON_ERROR_BODY, 400)
 
-    payload = request.get_json()
     cardholder_name = payload.get("cardholder_name", "").strip()
     card_number = (payload.get("card_number") or "").strip()
     expiry_month = (payload.get("expiry_month") or "").strip()
@@ -554,7 +920,7 @@ def billing_settings():
         return jsonify({"error": "Invalid invoice email"}), 400
 
     # Basic card validations (for demo only)
-    digits_only = "".join(ch for ch in card_number if ch.isdigit())
+    digits_only = NON_DIGIT_REGEX.sub("", card_number)
     if card_number:
         if len(digits_only) != 16:
             return jsonify({"error": "Card number must be 16 digits"}), 400
@@ -565,59 +931,51 @@ def billing_settings():
         if not cvv or len(cvv) < 3:
             return jsonify({"error": "Invalid CVV"}), 400
 
-    stored = r.hgetall(billing_key_name) or {}
-
-    # Only store last4, never full number (demo best practice)
+    # HSET only overwrites the named fields, so no read-modify-write is needed
+    # to preserve the rest. Only store last4, never full number (demo best practice)
+    update = {}
     if digits_only:
-        stored["cardholder_name"] = cardholder_name
-        stored["card_last4"] = digits_only[-4:]
+        update["cardholder_name"] = cardholder_name
+        update["card_last4"] = digits_only[-4:]
     if invoice_email:
-        stored["invoice_email"] = invoice_email
+        update["invoice_email"] = invoice_email
 
-    r.hset(billing_key_name, mapping=stored)
+    if update:
+        r.hset(billing_key_name, mapping=update)
 
     return jsonify({"message": "Billing info saved"}), 200
 
 @app.route("/settings/plans", methods=["GET", "PUT"])
 @require_auth
-def plans_settings():
-    r = get_redis()
-    if r is None:
-        return jsonify({"error": "Redis unavailable"}), 503
-
+@requires_redis
+def plans_settings(r):
     email = request.user_email
     plans_key_name = plans_key(email)
     billing_key_name = billing_key(email)
 
     if request.method == "GET":
         data = r.hgetall(plans_key_name) or {}
-        return jsonify({
-            "plan": data.get("plan", "basic"),
-            "extra_storage": data.get("extra_storage", "0") == "1",
-            "priority_support": data.get("priority_support", "0") == "1"
-        })
+        return jsonify(plans_payload(data))
 
     # PUT
-    if not request.is_json:
-        return jsonify({"error": "Expected JSON body"}), 400
+    payload = json_body()
+    if payload is None:
+        return static_json_response(EXPECTED_JSON_ERROR_BODY, 400)
 
-    payload = request.get_json()
     plan = payload.get("plan", "basic")
     extra_storage = bool(payload.get("extra_storage", False))
     priority_support = bool(payload.get("priority_support", False))
     total_price = int(payload.get("total_price", 0))
 
-    # If it's a paid plan, ensure billing method exists
-    billing_data = r.hgetall(billing_key_name) or {}
-    has_card = bool(billing_data.get("card_last4"))
-
-    if total_price > 0 and not has_card:
+    # If it's a paid plan, ensure billing method exists (only the one field
+    # is read, and free plans skip the lookup entirely)
+    if total_price > 0 and not r.hget(billing_key_name, "card_last4"):
         return jsonify({"error": "Add a billing method before selecting a paid plan"}), 400
 
     r.hset(plans_key_name, mapping={
         "plan": plan,
-        "extra_storage": "1" if extra_storage else "0",
-        "priority_support": "1" if priority_support else "0",
+        "extra_storage": BOOL_TO_FLAG[extra_storage],
+        "priority_support": BOOL_TO_FLAG[priority_support],
         "last_price": str(total_price)
     })
 
@@ -630,75 +988,73 @@ def plans_settings():
 
 @app.route("/users/<string:email>", methods=["GET"])
 @require_auth
-def get_user(email):
+@requires_redis
+def get_user(email, r):
     email = email.strip().lower()
     if email != request.user_email:
         return jsonify({"error": "Forbidden"}), 403
 
-    r = get_redis()
-    if r is None:
-        return jsonify({"error": "Redis unavailable"}), 503
-
-    user_key = generate_user_key(email)
-    user_data = r.hgetall(user_key)
-    if not user_data:
+    user_data = get_profile(r, email)
+    if user_data is None:
         return jsonify({"error": "User not found"}), 404
 
-    user_data.pop("password", None)
     return jsonify(user_data), 200
 
 
 @app.route("/users/<string:email>", methods=["PUT"])
 @require_auth
-def update_user(email):
+@requires_redis
+def update_user(email, r):
     email = email.strip().lower()
     if email != request.user_email:
         return jsonify({"error": "Forbidden"}), 403
 
-    if not request.is_json:
-        return jsonify({"error": "Expected JSON body"}), 400
-    data = request.get_json()
+    data = json_body()
+    if data is None:
+        return static_json_response(EXPECTED_JSON_ERROR_BODY, 400)
 
-    r = get_redis()
-    if r is None:
-        return jsonify({"error": "Redis unavailable"}), 503
-
-    user_key = generate_user_key(email)
-    if not r.exists(user_key):
-        return jsonify({"error": "User not found"}), 404
-
-    update_fields = {}
-    if "first_name" in data:
-        update_fields["first_name"] = data["first_name"]
-    if "last_name" in data:
-        update_fields["last_name"] = data["last_name"]
+    # Validate and build the whole update before touching Redis so it is
+    # applied in a single round-trip and bad input costs none.
+    update_fields = {field: data[field] for field in USER_UPDATE_FIELDS if field in data}
+    if not all(isinstance(value, str) for value in update_fields.values()):
+        return jsonify({"error": "first_name and last_name must be strings"}), 400
     if "password" in data and data["password"]:
+        if not isinstance(data["password"], str):
+            return jsonify({"error": "password must be a string"}), 400
         ok, msg = is_strong_password(data["password"])
         if not ok:
             return jsonify({"error": msg}), 400
-        update_fields["password"] = generate_password_hash(data["password"])
+        update_fields["password"] = hash_password(data["password"])
 
+    user_key = generate_user_key(email)
     try:
-        if update_fields:
-            r.hset(user_key, mapping=update_fields)
+        updated = _update_user_script(
+            keys=[user_key],
+            args=[item for pair in update_fields.items() for item in pair],
+            client=r,
+        )
+        if not updated:
+            return jsonify({"error": "User not found"}), 404
+
+        invalidate_profile(email)
         return jsonify({"message": "User updated successfully", "email": email}), 200
+    except REDIS_UNAVAILABLE_ERRORS:
+        raise
     except Exception as e:
         return jsonify({"error": f"Failed to update user: {str(e)}"}), 500
 
 
 @app.route("/users/<string:email>", methods=["DELETE"])
 @require_auth
-def delete_user(email):
+@requires_redis
+def delete_user(email, r):
     email = email.strip().lower()
     if email != request.user_email:
         return jsonify({"error": "Forbidden"}), 403
 
-    r = get_redis()
-    if r is None:
-        return jsonify({"error": "Redis unavailable"}), 503
-
     user_key = generate_user_key(email)
     deleted_count = r.delete(user_key)
+    invalidate_profile(email)
     if deleted_count == 0:
         return jsonify({"error": "User not found"}), 404
 